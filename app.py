@@ -1,16 +1,43 @@
 import os
+import re
+import difflib
+import hashlib
+import itertools
+import weakref
+import time
+import threading
+from urllib.parse import quote
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-import json
+from flask_compress import Compress
+from waitress import serve
+import orjson
+import pyarrow as pa
+import connectorx as cx
+import sqlglot
+from sqlglot import exp
+from sqlglot.tokens import TokenType
+
+# String helpers, compiled with mypyc when fastpath has been built
+from fastpath import build_prompt, clean_sql, is_select_query
 
 # Google Gemini AI
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 
 # Database connectors
 import sqlite3
-import mysql.connector
+from mysql.connector import pooling as mysql_pooling
 import psycopg2
+from psycopg2 import errors as pg_errors, pool as pg_pool
+from psycopg2.extras import RealDictCursor
 from pymongo import MongoClient
 
 # Load environment vars
@@ -20,244 +47,875 @@ load_dotenv(env_path)
 # Initialize Gemini
 genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
+# Fixed instructions sent as the system instruction, so prompts only carry the per-request parts
+_SYSTEM_PROMPT = """You are an expert SQL assistant. You convert natural language requests into database queries.
+
+Important guidelines:
+- Return only the SQL query, no explanations or formatting
+- Use the syntax of the database named in the request
+- Make sure column names and table names match the schema exactly
+- For aggregations, use appropriate GROUP BY clauses
+- Handle NULL values appropriately
+"""
+
+# Gemini answers with {"sql": "..."} JSON instead of free text that may be wrapped in markdown
+_SQL_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {"sql": {"type": "string"}},
+    "required": ["sql"]
+}
+
+# Shared by every request; system instructions and JSON mode need a Gemini 1.5 or newer model
+_MODEL = genai.GenerativeModel(
+    os.getenv('GEMINI_MODEL', 'gemini-1.5-flash'),
+    system_instruction=_SYSTEM_PROMPT,
+    generation_config={"response_mime_type": "application/json", "response_schema": _SQL_RESPONSE_SCHEMA}
+)
+
+def _json_default(obj):
+    # Driver types orjson doesn't encode itself
+    if isinstance(obj, (Decimal, timedelta)):
+        # Text keeps every digit of NUMERIC values, like Flask does for Decimal; MySQL TIME comes back as timedelta
+        return str(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        # bytea / BLOB columns
+        return bytes(obj).hex()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson, which encodes straight to bytes.
+    """
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_json_default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=_json_default), mimetype='application/json')
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
+# Compress JSON and NDJSON bodies; Arrow responses carry their own zstd compression
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+# Streamed (NDJSON) bodies use a separate list, whose default leaves out gzip
+app.config['COMPRESS_ALGORITHM_STREAMING'] = ['br', 'gzip', 'deflate']
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'application/x-ndjson', 'text/plain']
+Compress(app)
+
 # --------------------
 # Gemini SQL Generator with Auto-correction
 # --------------------
-def generate_sql_with_gemini(prompt: str, max_retries: int = 3) -> str:
+def parse_sql_response(text: str) -> str:
+    """
+    Return the query from a structured {"sql": ...} Gemini answer, or an empty string if it has none.
+    """
+    try:
+        answer = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # Not a structured answer, e.g. from a model without JSON mode
+        return clean_sql(text)
+    if isinstance(answer, dict) and 'sql' in answer:
+        sql = answer['sql']
+    elif isinstance(answer, str):
+        # A bare JSON string is the query itself
+        sql = answer
+    else:
+        # Some other JSON answer such as a MongoDB filter
+        return clean_sql(text)
+    # The query inside the JSON string can still be wrapped in ``` fences
+    return clean_sql(sql) if isinstance(sql, str) else ''
+
+# Generated SQL keyed by a BLAKE2 digest of the prompt, least recently used first
+SQL_CACHE_SIZE = 1024
+_SQL_CACHE: OrderedDict[bytes, str] = OrderedDict()
+_SQL_CACHE_LOCK = threading.Lock()
+
+def generate_sql_with_gemini(prompt: str, max_retries: int = 3, force_refresh: bool = False) -> str:
     """
     Send prompt to Gemini and return the SQL query string.
-    Uses the correct Gemini API format.
+    Answers are cached per prompt; force_refresh asks Gemini again and replaces the cached answer.
     """
+    key = hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+    if not force_refresh:
+        with _SQL_CACHE_LOCK:
+            sql = _SQL_CACHE.get(key)
+            if sql is not None:
+                _SQL_CACHE.move_to_end(key)
+                return sql
+
     try:
-        model = genai.GenerativeModel("gemini-pro")
-        response = model.generate_content(prompt)
-        sql = response.text.strip()
-        
-        # Clean the SQL (remove markdown formatting if present)
-        if sql.startswith('```sql'):
-            sql = sql.replace('```sql', '').replace('```', '').strip()
-        elif sql.startswith('```'):
-            sql = sql.replace('```', '').strip()
-            
-        return sql
+        response = _MODEL.generate_content(prompt)
+        sql = parse_sql_response(response.text)
+    except Exception as e:
+        raise Exception(f"Gemini API error: {str(e)}")
+    if not sql:
+        raise Exception("Gemini API error: no SQL query in the response")
+
+    with _SQL_CACHE_LOCK:
+        _SQL_CACHE[key] = sql
+        _SQL_CACHE.move_to_end(key)
+        if len(_SQL_CACHE) > SQL_CACHE_SIZE:
+            _SQL_CACHE.popitem(last=False)
+    return sql
+
+def generate_sql_candidates(prompt: str, n: int = 3) -> list:
+    """
+    Ask Gemini for several alternative SQL queries in a single request.
+    Returns the distinct candidates in the order Gemini ranked them.
+    """
+    try:
+        generation_config = {"candidate_count": n, "temperature": 0.3}
+        try:
+            response = _MODEL.generate_content(prompt, generation_config=generation_config)
+        except google_exceptions.InvalidArgument:
+            # Some models only support a single candidate per request
+            generation_config["candidate_count"] = 1
+            response = _MODEL.generate_content(prompt, generation_config=generation_config)
+
+        candidates = []
+        for candidate in response.candidates:
+            # Candidates stopped by safety filters come back without any content
+            text = ''.join(part.text for part in candidate.content.parts)
+            sql = parse_sql_response(text)
+            if sql and sql not in candidates:
+                candidates.append(sql)
+
+        if not candidates:
+            raise Exception("No SQL candidates returned")
+        return candidates
     except Exception as e:
         raise Exception(f"Gemini API error: {str(e)}")
 
-def auto_correct_and_execute(db_type: str, db_params: dict, sql: str, schema_info: str, original_question: str, max_retries: int = 3):
+# --------------------
+# Local SQL Repair
+# --------------------
+_SQLGLOT_DIALECTS = {'sqlite': 'sqlite', 'mysql': 'mysql', 'postgres': 'postgres'}
+
+# Dialects Gemini tends to slip into when it writes the wrong one
+_FALLBACK_DIALECTS = ('mysql', 'postgres', 'sqlite', 'tsql')
+
+# Unknown identifier named in SQLite, MySQL and PostgreSQL error messages
+_MISSING_COLUMN_RE = re.compile(
+    r"no such column: (?:\w+\.)?(\w+)|Unknown column '(?:[^']*\.)?([^']+)'|column \"?(?:\w+\.)?(\w+)\"? does not exist",
+    re.I
+)
+_MISSING_TABLE_RE = re.compile(
+    r"no such table: (?:\w+\.)?(\w+)|Table '(?:[^']*\.)?([^']+)' doesn't exist|relation \"?(?:\w+\.)?(\w+)\"? does not exist",
+    re.I
+)
+
+# "TABLE:" and "  - COLUMN (TYPE)" lines of the schema text
+_SCHEMA_TABLE_RE = re.compile(r'^(\w+):\s*$', re.M)
+_SCHEMA_COLUMN_RE = re.compile(r'^\s+- (\w+) \(', re.M)
+
+def _closest_name(name: str, names: list):
     """
-    Execute SQL with auto-correction capability.
-    If the query fails, it will attempt to fix it using Gemini.
+    Return the schema name that looks most like name, or None if nothing is close or it is already right.
+    """
+    by_lower = {}
+    for n in names:
+        by_lower.setdefault(n.lower(), n)
+    matches = difflib.get_close_matches(name.lower(), list(by_lower), n=1, cutoff=0.6)
+    if not matches or matches[0] == name.lower():
+        return None
+    return by_lower[matches[0]]
+
+def repair_sql_locally(sql: str, error_msg: str, schema_info: str, db_type: str):
     """
-    for attempt in range(max_retries):
+    Try to fix a failed query without Gemini: re-emit SQL written in another dialect,
+    and, in read-only queries, swap misspelled unquoted table/column names for the
+    closest name in the schema.
+    Returns the repaired SQL, or None if nothing could be fixed.
+    """
+    dialect = _SQLGLOT_DIALECTS.get(db_type)
+    if dialect is None:
+        return None
+
+    changed = False
+    tree = None
+    for read in (dialect,) + _FALLBACK_DIALECTS:
         try:
-            # Execute the SQL query
-            if db_type == 'sqlite':
-                results = execute_sql_sqlite(db_params['path'], sql)
-            elif db_type == 'mysql':
-                results = execute_sql_mysql(db_params, sql)
-            elif db_type == 'postgres':
-                results = execute_sql_postgres(db_params, sql)
-            elif db_type == 'mongo':
-                # For MongoDB, we need to convert SQL-like query to MongoDB query
-                results = execute_sql_mongo(db_params, sql, db_params.get('collection'))
-            else:
-                raise Exception('Unsupported database type')
-            
-            return {
-                'success': True,
-                'results': results,
-                'final_sql': sql,
-                'attempts': attempt + 1
-            }
-            
-        except Exception as e:
-            error_msg = str(e)
-            
-            if attempt < max_retries - 1:  # Not the last attempt
-                # Generate correction prompt
-                correction_prompt = f"""
-The following SQL query failed with error: {error_msg}
-
-Original question: {original_question}
-Schema: {schema_info}
+            tree = sqlglot.parse_one(sql, read=read)
+            # Parsing only in another dialect means the query can be translated
+            changed = read != dialect
+            break
+        except sqlglot.errors.SqlglotError:
+            continue
+    if tree is None:
+        return None
+
+    # A wrong guess in a write would be committed unseen, so only read-only queries get names swapped
+    read_only = isinstance(tree, exp.Query) and tree.find(exp.Insert, exp.Update, exp.Delete, exp.Merge) is None
+
+    missing = _MISSING_COLUMN_RE.search(error_msg) if read_only else None
+    if missing:
+        bad_name = next(group for group in missing.groups() if group)
+        replacement = _closest_name(bad_name, _SCHEMA_COLUMN_RE.findall(schema_info))
+        for column in tree.find_all(exp.Column):
+            # "x" is a string literal written with the wrong quotes as often as a column; leave it to Gemini
+            if replacement and column.name.lower() == bad_name.lower() and not column.this.quoted:
+                column.set('this', exp.to_identifier(replacement))
+                changed = True
+
+    missing = _MISSING_TABLE_RE.search(error_msg) if read_only else None
+    if missing:
+        bad_name = next(group for group in missing.groups() if group)
+        replacement = _closest_name(bad_name, [t for t in _SCHEMA_TABLE_RE.findall(schema_info) if t != 'Tables'])
+        for table in tree.find_all(exp.Table):
+            if replacement and table.name.lower() == bad_name.lower() and not table.this.quoted:
+                table.set('this', exp.to_identifier(replacement))
+                changed = True
+
+    return tree.sql(dialect=dialect) if changed else None
+
+# --------------------
+# Query Execution
+# --------------------
+# Connection params connection_uri can express; anything else (sslmode, unix_socket, ...) goes to the driver only
+_URI_PARAMS = frozenset({'host', 'port', 'user', 'password', 'database', 'dbname'})
+
+def connection_uri(db_type: str, params: dict) -> str:
+    scheme, default_port = ('postgresql', 5432) if db_type == 'postgres' else ('mysql', 3306)
+    user = quote(str(params.get('user', '')), safe='')
+    password = quote(str(params.get('password') or ''), safe='')
+    host = params.get('host', 'localhost')
+    port = params.get('port') or default_port
+    database = quote(str(params.get('database') or params.get('dbname') or ''), safe='')
+    return f"{scheme}://{user}:{password}@{host}:{port}/{database}"
+
+# connectorx opens a new connection for every read, which only pays off for big results.
+# A SELECT is read through it once the pooled driver has returned at least
+# CONNECTORX_MIN_ROWS rows for it; (db_type, params, sql) -> whether connectorx can read it
+CONNECTORX_MIN_ROWS = 10_000
+CONNECTORX_QUERIES_SIZE = 1024
+_CONNECTORX_QUERIES: OrderedDict[tuple, bool] = OrderedDict()
+_CONNECTORX_QUERIES_LOCK = threading.Lock()
+
+# Prefixes connectorx gives errors reported by the server itself
+_CONNECTORX_SERVER_ERRORS = ('db error', 'MySqlError')
+
+def _strip_sql_tail(sql: str, dialect: str) -> str:
+    """
+    Drop trailing semicolons, comments and whitespace, so the query can be wrapped in parentheses.
+    """
+    try:
+        tokens = sqlglot.tokenize(sql, read=dialect)
+    except sqlglot.errors.SqlglotError:
+        return sql.strip().rstrip(';')
+    while tokens and tokens[-1].token_type == TokenType.SEMICOLON:
+        tokens.pop()
+    return sql[:tokens[-1].end + 1] if tokens else sql
+
+def read_sql_arrow(db_type: str, db_params: dict, sql: str, key: tuple):
+    """
+    Read a large SELECT straight into a pyarrow Table with connectorx.
+    Returns None if connectorx can't read the query, so the caller uses the driver instead.
+    """
+    # connectorx runs COPY (<sql>) TO STDOUT and only removes a final ';' itself
+    query = _strip_sql_tail(sql, _SQLGLOT_DIALECTS[db_type])
+    try:
+        return cx.read_sql(connection_uri(db_type, db_params), query, return_type='arrow')
+    except Exception as e:
+        if str(e).startswith(_CONNECTORX_SERVER_ERRORS):
+            # The query itself failed (e.g. the schema changed); running it again on the
+            # driver would only repeat the error
+            raise
+        # Column types connectorx doesn't support, ...; keep this query on the driver
+        app.logger.warning("connectorx could not read query, using the driver: %s", e)
+        with _CONNECTORX_QUERIES_LOCK:
+            _CONNECTORX_QUERIES[key] = False
+        return None
+
+def execute_sql(db_type: str, db_params: dict, sql: str, stream: bool = False, arrow: bool = False):
+    """
+    Run the query on the given database. With stream=True, row results come back
+    as a RowStream instead of a list. With arrow=True, Postgres and MySQL SELECTs
+    known to return many rows are read by connectorx straight into a pyarrow Table.
+    """
+    key = None
+    if arrow and db_type in ('postgres', 'mysql') and db_params.keys() <= _URI_PARAMS and is_select_query(sql):
+        key = (db_type, frozenset(db_params.items()), sql)
+        with _CONNECTORX_QUERIES_LOCK:
+            use_connectorx = _CONNECTORX_QUERIES.get(key)
+            if use_connectorx is not None:
+                _CONNECTORX_QUERIES.move_to_end(key)
+        if use_connectorx:
+            table = read_sql_arrow(db_type, db_params, sql, key)
+            if table is not None:
+                return table
+
+    results = _execute_sql_driver(db_type, db_params, sql, stream)
+    if key is not None and isinstance(results, list) and len(results) >= CONNECTORX_MIN_ROWS:
+        with _CONNECTORX_QUERIES_LOCK:
+            _CONNECTORX_QUERIES.setdefault(key, True)
+            if len(_CONNECTORX_QUERIES) > CONNECTORX_QUERIES_SIZE:
+                _CONNECTORX_QUERIES.popitem(last=False)
+    return results
+
+def _execute_sql_driver(db_type: str, db_params: dict, sql: str, stream: bool = False):
+    """
+    Run the query through the pooled driver of the database type.
+    """
+    if db_type == 'sqlite':
+        return execute_sql_sqlite(db_params['path'], sql, stream)
+    elif db_type == 'mysql':
+        return execute_sql_mysql(db_params, sql, stream)
+    elif db_type == 'postgres':
+        return execute_sql_postgres(db_params, sql, stream)
+    elif db_type == 'mongo':
+        # For MongoDB, we need to convert SQL-like query to MongoDB query
+        return execute_sql_mongo(db_params, sql, db_params.get('collection'), stream)
+    else:
+        raise Exception('Unsupported database type')
+
+# Prompt asking Gemini to fix a query that failed
+_CORRECTION_TEMPLATE = """
+The following SQL query failed with error: {error}
+
+Original question: {question}
+Schema: {schema}
 Failed SQL: {sql}
 
 Please provide a corrected SQL query that fixes this error. 
 Return only the SQL query without any explanation or formatting.
 """
-                try:
-                    corrected_sql = generate_sql_with_gemini(correction_prompt)
-                    sql = corrected_sql  # Use corrected SQL for next attempt
-                except Exception as correction_error:
-                    return {
-                        'success': False,
-                        'error': f"Auto-correction failed: {str(correction_error)}",
-                        'original_error': error_msg,
-                        'attempts': attempt + 1
-                    }
-            else:
-                # Last attempt failed
+
+def auto_correct_and_execute(db_type: str, db_params: dict, sql: str, schema_info: str, original_question: str, max_retries: int = 3, stream: bool = False, arrow: bool = False):
+    """
+    Execute SQL with auto-correction capability.
+    If the query fails, cheap local repairs are tried first. After that Gemini is
+    asked for several corrected queries at once, and each of them is tried
+    before asking again (up to max_retries rounds).
+    """
+    attempts = 0
+    correction_round = 0
+    tried = set()
+    candidates = [sql]
+
+    while True:
+        for candidate in candidates:
+            if candidate in tried:
+                continue
+            tried.add(candidate)
+            attempts += 1
+
+            try:
+                results = execute_sql(db_type, db_params, candidate, stream, arrow)
                 return {
-                    'success': False,
-                    'error': error_msg,
-                    'final_sql': sql,
-                    'attempts': attempt + 1
+                    'success': True,
+                    'results': results,
+                    'final_sql': candidate,
+                    'attempts': attempts
                 }
+            except Exception as e:
+                sql = candidate
+                error_msg = str(e)
+
+        # Dialect and identifier fixes need no round-trip to Gemini
+        repaired_sql = repair_sql_locally(sql, error_msg, schema_info, db_type)
+        if repaired_sql is not None and repaired_sql not in tried:
+            candidates = [repaired_sql]
+            continue
+
+        correction_round += 1
+        if correction_round == max_retries:
+            break
+
+        correction_prompt = _CORRECTION_TEMPLATE.format_map({
+            'error': error_msg,
+            'question': original_question,
+            'schema': schema_info,
+            'sql': sql
+        })
+        try:
+            candidates = generate_sql_candidates(correction_prompt)
+        except Exception as correction_error:
+            return {
+                'success': False,
+                'error': f"Auto-correction failed: {str(correction_error)}",
+                'original_error': error_msg,
+                'attempts': attempts
+            }
+
+    # Every attempt failed
+    return {
+        'success': False,
+        'error': error_msg,
+        'final_sql': sql,
+        'attempts': attempts
+    }
+
+# --------------------
+# Connection Pools
+# --------------------
+MYSQL_POOL_SIZE = 8
+POSTGRES_POOL_SIZE = 16
+
+# (db_type, params) -> (pool, semaphore bounding checkouts to the pool size)
+_POOLS: dict[tuple, tuple[object, threading.BoundedSemaphore]] = {}
+_POOLS_LOCK = threading.Lock()
+
+# Each worker thread keeps its own SQLite connection per database file
+_SQLITE_LOCAL = threading.local()
+
+class PostgresConnectionPool(pg_pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that keeps every returned connection open for reuse.
+    """
+    def __init__(self, maxconn: int, **params):
+        # Open a single connection up front, the rest as demand grows
+        super().__init__(1, maxconn, **params)
+        # putconn only keeps a connection while fewer than minconn are idle and closes the others
+        self.minconn = maxconn
+
+def _get_pool(db_type: str, params: dict):
+    key = (db_type, frozenset(params.items()))
+    entry = _POOLS.get(key)
+    if entry is None:
+        with _POOLS_LOCK:
+            entry = _POOLS.get(key)
+            if entry is None:
+                if db_type == 'mysql':
+                    pool = mysql_pooling.MySQLConnectionPool(pool_size=MYSQL_POOL_SIZE, **params)
+                    size = MYSQL_POOL_SIZE
+                else:
+                    pool = PostgresConnectionPool(POSTGRES_POOL_SIZE, **params)
+                    size = POSTGRES_POOL_SIZE
+                entry = (pool, threading.BoundedSemaphore(size))
+                _POOLS[key] = entry
+    return entry
+
+@contextmanager
+def sqlite_connection(db_path: str):
+    connections = getattr(_SQLITE_LOCAL, 'connections', None)
+    if connections is None:
+        connections = _SQLITE_LOCAL.connections = {}
+
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        connections[db_path] = conn
+
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+
+@contextmanager
+def mysql_connection(params: dict):
+    # Pools raise instead of waiting when exhausted, so wait on the semaphore first
+    pool, slots = _get_pool('mysql', params)
+    with slots:
+        conn = pool.get_connection()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()  # Returns the connection to the pool
+
+@contextmanager
+def postgres_connection(params: dict):
+    pool, slots = _get_pool('postgres', params)
+    with slots:
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn)  # Rolls back any open transaction
+
+# MongoClient pools connections itself and is thread-safe, so one is shared per server login
+_MONGO_CLIENTS: dict[tuple, MongoClient] = {}
+
+def mongo_client(params: dict) -> MongoClient:
+    key = (params.get('host', 'localhost'), params.get('port', 27017), params.get('username'), params.get('password'))
+    client = _MONGO_CLIENTS.get(key)
+    if client is None:
+        with _POOLS_LOCK:
+            client = _MONGO_CLIENTS.get(key)
+            if client is None:
+                client = MongoClient(host=key[0], port=key[1], username=key[2], password=key[3])
+                _MONGO_CLIENTS[key] = client
+    return client
 
 # --------------------
 # Database Connection Functions
 # --------------------
-def execute_sql_sqlite(db_path: str, sql: str):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # This allows column names in results
-    cur = conn.cursor()
-    cur.execute(sql)
-    
-    if sql.strip().upper().startswith('SELECT'):
-        results = [dict(row) for row in cur.fetchall()]
-    else:
-        conn.commit()
-        results = {"affected_rows": cur.rowcount}
-    
-    conn.close()
+# Rows fetched from the server per round-trip when streaming results
+STREAM_BATCH_SIZE = 2000
+
+class RowStream:
+    """
+    Lazily yields result rows and hands the connection back once exhausted or closed.
+    """
+    def __init__(self, rows, resources: ExitStack):
+        self._rows = rows
+        self._resources = resources
+
+    def __iter__(self):
+        try:
+            yield from self._rows
+        finally:
+            self.close()
+
+    def close(self):
+        self._resources.close()
+
+def execute_sql_sqlite(db_path: str, sql: str, stream: bool = False):
+    with ExitStack() as resources:
+        conn = resources.enter_context(sqlite_connection(db_path))
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row  # This allows column names in results
+        cur.execute(sql)
+
+        # Whether rows come back decides it, not the keyword: WITH ... DELETE returns none,
+        # DELETE ... RETURNING does
+        if cur.description is None:
+            conn.commit()
+            results = {"affected_rows": cur.rowcount}
+        else:
+            rows = (dict(row) for row in cur)
+            # Only plain reads are streamed; RETURNING rows are fetched so the change can be committed
+            if stream and not conn.in_transaction:
+                return RowStream(rows, resources.pop_all())
+            results = list(rows)
+            conn.commit()
+
     return results
 
-def execute_sql_mysql(params: dict, sql: str):
-    conn = mysql.connector.connect(**params)
-    cur = conn.cursor(dictionary=True)  # Return results as dictionaries
-    cur.execute(sql)
-    
-    if sql.strip().upper().startswith('SELECT'):
-        results = cur.fetchall()
-    else:
+def execute_sql_mysql(params: dict, sql: str, stream: bool = False):
+    with ExitStack() as resources:
+        conn = resources.enter_context(mysql_connection(params))
+        is_select = is_select_query(sql)
+
+        if stream and is_select:
+            # Unbuffered: rows are pulled from the server as the client reads them
+            cur = conn.cursor(dictionary=True, buffered=False)
+            # Drain whatever the client did not read before the connection goes back to the pool
+            resources.callback(conn.consume_results)
+            cur.execute(sql)
+            if cur.description is not None:
+                return RowStream(iter(cur), resources.pop_all())
+            conn.commit()
+            return {"affected_rows": cur.rowcount}
+
+        cur = conn.cursor(dictionary=True)  # Return results as dictionaries
+        cur.execute(sql)
+
+        # WITH ... UPDATE/DELETE starts like a query but has no result set
+        results = cur.fetchall() if cur.description is not None else {"affected_rows": cur.rowcount}
         conn.commit()
-        results = {"affected_rows": cur.rowcount}
-    
-    conn.close()
+
     return results
 
-def execute_sql_postgres(params: dict, sql: str):
-    conn = psycopg2.connect(**params)
-    cur = conn.cursor()
+# Prepared statements kept per pooled Postgres connection before they are all deallocated
+PG_PREPARED_STATEMENTS_LIMIT = 128
+# Statements remembered per connection as run once or unpreparable, least recently used dropped first
+PG_SEEN_STATEMENTS_LIMIT = 1024
+
+# connection -> (names of PREPAREd statements, OrderedDict of other statement names -> _SEEN / _UNPREPARABLE)
+_PG_STATEMENTS = weakref.WeakKeyDictionary()
+_SEEN, _UNPREPARABLE = 'seen', 'unpreparable'
+
+# EXECUTE errors that mean the prepared statement is unusable, e.g. "cached plan must not
+# change result type" after ALTER TABLE, rather than that the query itself failed
+_STALE_STATEMENT_ERRORS = (pg_errors.FeatureNotSupported, pg_errors.InvalidSqlStatementName)
+
+def _is_single_statement(sql: str) -> bool:
+    # PREPARE would take the first of several statements and run the rest right away
+    try:
+        return len(sqlglot.parse(sql, read='postgres')) == 1
+    except sqlglot.errors.SqlglotError:
+        return False
+
+def _execute_postgres(conn, cur, sql: str):
+    """
+    Execute sql on a pooled connection. A statement that runs a second time on the
+    same connection is PREPAREd, so later runs reuse the parsed and planned statement.
+    """
+    prepared, seen = _PG_STATEMENTS.setdefault(conn, (set(), OrderedDict()))
+    name = 'q_' + hashlib.sha1(sql.encode()).hexdigest()[:16]
+
+    if name in prepared:
+        try:
+            cur.execute(f"EXECUTE {name};")
+            return
+        except _STALE_STATEMENT_ERRORS as e:
+            # Drop the statement and run it as it is; the next run prepares it again
+            conn.rollback()
+            prepared.discard(name)
+            if not isinstance(e, pg_errors.InvalidSqlStatementName):
+                cur.execute(f"DEALLOCATE {name};")
+
+    elif seen.get(name) == _SEEN:
+        del seen[name]
+        if _is_single_statement(sql):
+            if len(prepared) >= PG_PREPARED_STATEMENTS_LIMIT:
+                cur.execute("DEALLOCATE ALL;")
+                prepared.clear()
+            try:
+                cur.execute(f"PREPARE {name} AS {sql.strip().rstrip(';')}")
+                prepared.add(name)
+            except psycopg2.Error:
+                # DDL, ... can't be prepared; run it as it is
+                conn.rollback()
+        if name in prepared:
+            cur.execute(f"EXECUTE {name};")
+            return
+        seen[name] = _UNPREPARABLE
+
+    seen.setdefault(name, _SEEN)
+    seen.move_to_end(name)
+    if len(seen) > PG_SEEN_STATEMENTS_LIMIT:
+        seen.popitem(last=False)
     cur.execute(sql)
-    
-    if sql.strip().upper().startswith('SELECT'):
-        columns = [desc[0] for desc in cur.description]
-        rows = cur.fetchall()
-        results = [dict(zip(columns, row)) for row in rows]
-    else:
+
+def execute_sql_postgres(params: dict, sql: str, stream: bool = False):
+    with ExitStack() as resources:
+        conn = resources.enter_context(postgres_connection(params))
+        is_select = is_select_query(sql)
+
+        if stream and is_select:
+            # Server-side cursor: rows are fetched STREAM_BATCH_SIZE at a time
+            cur = conn.cursor(name='datatalk_stream', cursor_factory=RealDictCursor)
+            cur.itersize = STREAM_BATCH_SIZE
+            try:
+                cur.execute(sql)
+                return RowStream(iter(cur), resources.pop_all())
+            except pg_errors.FeatureNotSupported:
+                # A cursor can't be declared over WITH ... INSERT/UPDATE/DELETE; run it below
+                conn.rollback()
+
+        cur = conn.cursor(cursor_factory=RealDictCursor)  # Return results as dictionaries
+        _execute_postgres(conn, cur, sql)
+
+        # WITH ... DELETE starts like a query but only returns rows with RETURNING,
+        # and either way its changes need the commit
+        results = cur.fetchall() if cur.description is not None else {"affected_rows": cur.rowcount}
         conn.commit()
-        results = {"affected_rows": cur.rowcount}
-    
-    conn.close()
+
     return results
 
-def execute_sql_mongo(params: dict, query_text: str, collection: str):
+# Documents fetched from MongoDB per round-trip
+MONGO_BATCH_SIZE = 500
+
+def _mongo_documents(first, cursor):
+    if first is None:
+        return
+    for doc in itertools.chain((first,), cursor):
+        # Convert ObjectId to string for JSON serialization as each document goes by
+        if '_id' in doc:
+            doc['_id'] = str(doc['_id'])
+        yield doc
+
+def execute_sql_mongo(params: dict, query_text: str, collection: str, stream: bool = False):
     """
     For MongoDB, we need to convert natural language to MongoDB query syntax
     """
     # This is a simplified approach - in practice, you'd want more sophisticated parsing
-    client = MongoClient(host=params.get('host', 'localhost'), 
-                        port=params.get('port', 27017),
-                        username=params.get('username'),
-                        password=params.get('password'))
-    
-    db = client[params.get('database')]
+    db = mongo_client(params)[params.get('database')]
     coll = db[collection]
     
     # Try to parse the query_text as a MongoDB query
     try:
         if query_text.strip().startswith('{'):
             # Assume it's already a MongoDB query
-            mongo_query = json.loads(query_text)
+            mongo_query = orjson.loads(query_text)
         else:
             # Convert SQL-like syntax to basic MongoDB query
             # This is very basic - you might want to enhance this
             mongo_query = {}
         
-        results = list(coll.find(mongo_query))
-        # Convert ObjectId to string for JSON serialization
-        for result in results:
-            if '_id' in result:
-                result['_id'] = str(result['_id'])
+        cursor = coll.find(mongo_query).batch_size(MONGO_BATCH_SIZE)
+        # find() is lazy: pull the first batch now so query errors surface here
+        first = next(cursor, None)
     except Exception as e:
         raise Exception(f"MongoDB query error: {str(e)}")
-    finally:
-        client.close()
-    
-    return results
+
+    documents = _mongo_documents(first, cursor)
+    if stream:
+        resources = ExitStack()
+        resources.callback(cursor.close)
+        return RowStream(documents, resources)
+
+    return list(documents)
 
 # --------------------
 # Helper Functions
 # --------------------
-def build_prompt(question: str, schema_info: str, db_type: str) -> str:
-    prompt = f"""
-You are an expert SQL assistant. Convert the following natural language request into a {db_type.upper()} query.
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
 
-Database Schema:
-{schema_info}
+def arrow_ipc_stream(header: dict, results) -> bytes:
+    """
+    Encode a pyarrow Table or a list of rows as an Arrow IPC stream,
+    with the outcome stored as JSON under the "result" schema metadata key.
+    """
+    if isinstance(results, pa.Table):
+        table = results
+    else:
+        # Columns come from every row, not just the first: MongoDB documents can each have other fields
+        names = dict.fromkeys(name for row in results for name in row)
+        table = pa.Table.from_pydict({name: [row.get(name) for row in results] for name in names})
+    table = table.replace_schema_metadata({'result': orjson.dumps(header, default=_json_default)})
 
-Natural Language Request: {question}
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression='zstd')
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
 
-Important guidelines:
-- Return only the SQL query, no explanations or formatting
-- Use proper {db_type.upper()} syntax
-- Make sure column names and table names match the schema exactly
-- For aggregations, use appropriate GROUP BY clauses
-- Handle NULL values appropriately
+def ndjson_lines(header: dict, rows):
+    yield orjson.dumps(header, default=_json_default, option=orjson.OPT_APPEND_NEWLINE)
+    try:
+        for row in rows:
+            yield orjson.dumps(row, default=_json_default, option=orjson.OPT_APPEND_NEWLINE)
+    except Exception as e:
+        # The success header is already sent, so a failed fetch ends the stream with an error line
+        yield orjson.dumps({'success': False, 'error': str(e)}, option=orjson.OPT_APPEND_NEWLINE)
 
-SQL Query:
-"""
-    return prompt
+# Cached schema strings keyed by connection signature:
+# key -> (schema version, time of last version check, formatted schema)
+_SCHEMA_CACHE: dict[tuple, tuple[object, float, str]] = {}
 
-def get_schema_info(db_type: str, db_params: dict) -> str:
+# Servers without a cheap schema version counter are only re-checked after this many seconds
+SCHEMA_CACHE_TTL = 60
+
+# Upper bound on concurrent collection probes when sampling a MongoDB schema
+MONGO_SCHEMA_WORKERS = 16
+
+def _schema_cache_key(db_type: str, db_params: dict) -> tuple:
+    return (db_type, frozenset(db_params.items()))
+
+def get_schema_version(db_type: str, db_params: dict):
     """
-    Automatically extract schema information from the database
+    Return a cheap fingerprint of the current schema, or None if the database type has none.
     """
-    try:
-        if db_type == 'sqlite':
-            conn = sqlite3.connect(db_params['path'])
+    if db_type == 'sqlite':
+        with sqlite_connection(db_params['path']) as conn:
+            return conn.execute("PRAGMA schema_version;").fetchone()[0]
+
+    elif db_type == 'mysql':
+        with mysql_connection(db_params) as conn:
             cur = conn.cursor()
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cur.fetchall()
-            
-            schema_info = "Tables:\n"
-            for table in tables:
-                table_name = table[0]
-                cur.execute(f"PRAGMA table_info({table_name});")
-                columns = cur.fetchall()
-                schema_info += f"\n{table_name}:\n"
-                for col in columns:
-                    schema_info += f"  - {col[1]} ({col[2]})\n"
-            
-            conn.close()
-            return schema_info
-            
-        elif db_type == 'mysql':
-            conn = mysql.connector.connect(**db_params)
+            cur.execute(
+                "SELECT COUNT(*), COALESCE(SUM(CRC32(CONCAT_WS(':', TABLE_NAME, COLUMN_NAME, COLUMN_TYPE))), 0) "
+                "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE();"
+            )
+            return tuple(int(value) for value in cur.fetchone())
+
+    elif db_type == 'postgres':
+        with postgres_connection(db_params) as conn:
             cur = conn.cursor()
-            cur.execute("SHOW TABLES;")
-            tables = cur.fetchall()
-            
-            schema_info = "Tables:\n"
-            for table in tables:
-                table_name = table[0]
-                cur.execute(f"DESCRIBE {table_name};")
-                columns = cur.fetchall()
-                schema_info += f"\n{table_name}:\n"
-                for col in columns:
-                    schema_info += f"  - {col[0]} ({col[1]})\n"
-            
-            conn.close()
-            return schema_info
-            
-        # Add similar logic for PostgreSQL and MongoDB
+            cur.execute(
+                "SELECT COALESCE(md5(string_agg(table_name || ':' || column_name || ':' || data_type, ',' "
+                "ORDER BY table_name, ordinal_position)), '') "
+                "FROM information_schema.columns WHERE table_schema = ANY (current_schemas(false));"
+            )
+            return cur.fetchone()[0]
+
+    # MongoDB has no schema to version: fields change with the documents, and only
+    # sampling them again (as extract_schema_info does) would notice
+    return None
+
+def format_schema(columns) -> str:
+    """
+    Format (table, column, type) rows, grouped by table, into the schema text sent to Gemini.
+    """
+    # Collect fragments and join once; repeated += on a str copies the whole text each time
+    parts = ["Tables:\n"]
+    current_table = None
+    for table_name, col_name, col_type in columns:
+        if table_name != current_table:
+            parts.append(f"\n{table_name}:\n")
+            current_table = table_name
+        parts.append(f"  - {col_name} ({col_type})\n")
+    return ''.join(parts)
+
+def extract_schema_info(db_type: str, db_params: dict) -> str:
+    """
+    Read the table and column layout straight from the database,
+    fetching every column of every table in a single query
+    """
+    if db_type == 'sqlite':
+        with sqlite_connection(db_params['path']) as conn:
+            columns = conn.execute(
+                "SELECT m.name, p.name, p.type "
+                "FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+                "WHERE m.type='table' ORDER BY m.name, p.cid;"
+            ).fetchall()
+        return format_schema(columns)
+
+    elif db_type == 'mysql':
+        with mysql_connection(db_params) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, ORDINAL_POSITION;"
+            )
+            columns = cur.fetchall()
+        return format_schema(columns)
+
+    elif db_type == 'postgres':
+        with postgres_connection(db_params) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT table_name, column_name, data_type FROM information_schema.columns "
+                "WHERE table_schema = ANY (current_schemas(false)) ORDER BY table_name, ordinal_position;"
+            )
+            columns = cur.fetchall()
+        return format_schema(columns)
+
+    elif db_type == 'mongo':
+        db = mongo_client(db_params)[db_params.get('database')]
+        names = sorted(db.list_collection_names())
+
+        # Sample one document per collection, probing the collections concurrently
+        with ThreadPoolExecutor(max_workers=max(1, min(len(names), MONGO_SCHEMA_WORKERS))) as executor:
+            samples = list(executor.map(lambda name: db[name].find_one(), names))
+
+        columns = [
+            (name, field, type(value).__name__)
+            for name, sample in zip(names, samples) if sample
+            for field, value in sample.items()
+        ]
+        return format_schema(columns)
+
+    else:
+        return "Schema auto-detection not implemented for this database type yet."
+
+def get_schema_info(db_type: str, db_params: dict) -> str:
+    """
+    Automatically extract schema information from the database.
+    Results are cached until the database reports a schema change.
+    """
+    try:
+        key = _schema_cache_key(db_type, db_params)
+        cached = _SCHEMA_CACHE.get(key)
+        now = time.monotonic()
+
+        # Servers without a version counter are trusted for a short while before re-checking
+        if cached and db_type != 'sqlite' and now - cached[1] < SCHEMA_CACHE_TTL:
+            return cached[2]
+
+        version = get_schema_version(db_type, db_params)
+        if version is None:
+            return extract_schema_info(db_type, db_params)
+
+        if cached and cached[0] == version:
+            schema_info = cached[2]
         else:
-            return "Schema auto-detection not implemented for this database type yet."
-            
+            schema_info = extract_schema_info(db_type, db_params)
+        _SCHEMA_CACHE[key] = (version, now, schema_info)
+        return schema_info
+
     except Exception as e:
         return f"Could not retrieve schema: {str(e)}"
 
@@ -270,13 +928,14 @@ def generate_query():
     question = data.get('question')
     schema = data.get('schema')
     db_type = data.get('db_type', 'sqlite')
+    force_refresh = bool(data.get('force_refresh', False))
 
     if not question or not schema:
         return jsonify({'error': 'Provide question and schema'}), 400
 
     prompt = build_prompt(question, schema, db_type)
     try:
-        sql = generate_sql_with_gemini(prompt)
+        sql = generate_sql_with_gemini(prompt, force_refresh=force_refresh)
         return jsonify({'sql': sql})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -290,12 +949,38 @@ def execute_query():
     schema = data.get('schema', '')
     question = data.get('question', '')
 
+    response_format = data.get('format', 'json')
+
     if not all([db_type, db_params, sql]):
         return jsonify({'error': 'dbType, dbParams, and sql required'}), 400
 
     # Execute with auto-correction
-    result = auto_correct_and_execute(db_type, db_params, sql, schema, question)
+    # Arrow needs every row up front, so it fetches them while auto-correction can still react to errors
+    stream = response_format == 'ndjson'
+    arrow = response_format == 'arrow'
+    result = auto_correct_and_execute(db_type, db_params, sql, schema, question, stream=stream, arrow=arrow)
     
+    if result['success'] and (stream or arrow) and not isinstance(result['results'], dict):
+        header = {
+            'success': True,
+            'final_sql': result['final_sql'],
+            'attempts': result['attempts']
+        }
+
+        if stream:
+            # First line carries the outcome, every following line is one row
+            response = Response(ndjson_lines(header, result['results']), mimetype='application/x-ndjson')
+            if isinstance(result['results'], RowStream):
+                response.call_on_close(result['results'].close)
+            return response
+
+        try:
+            return Response(arrow_ipc_stream(header, result['results']), mimetype=ARROW_STREAM_MIMETYPE)
+        except (pa.ArrowException, OverflowError):
+            # Columns mixing value types or integers beyond int64 don't fit Arrow's typed columns,
+            # send plain JSON instead
+            pass
+
     if result['success']:
         return jsonify({
             'success': True,
@@ -333,4 +1018,10 @@ def health_check():
     return jsonify({'status': 'healthy'})
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5000)), debug=True)
\ No newline at end of file
+    port = int(os.getenv('PORT', 5000))
+    if os.getenv('FLASK_DEBUG'):
+        app.run(host='0.0.0.0', port=port, debug=True)
+    else:
+        # Requests spend most of their time waiting on Gemini and the database,
+        # so keep plenty of worker threads to have many of them in flight at once
+        serve(app, host='0.0.0.0', port=port, threads=int(os.getenv('WSGI_THREADS', 32)))
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""
+String helpers run on every request.
+
+Kept free of dynamic typing so the module can be compiled with mypyc
+(`mypyc fastpath.py`); the compiled extension is then imported in place of this file.
+"""
+import re
+from typing import Final
+
+# Opening (optionally ```sql) and closing markdown fences around generated SQL
+_FENCE_RE: Final = re.compile(r'^```(?:sql)?\s*|```\s*$', re.I | re.M)
+
+# Queries that produce a result set
+_SELECT_RE: Final = re.compile(r'^\s*(SELECT|WITH)\b', re.I)
+
+def clean_sql(sql: str) -> str:
+    """
+    Strip whitespace and any markdown code fences around a generated query.
+    """
+    return _FENCE_RE.sub('', sql).strip()
+
+def is_select_query(sql: str) -> bool:
+    return _SELECT_RE.match(sql) is not None
+
+def build_prompt(question: str, schema_info: str, db_type: str) -> str:
+    prompt = f"""
+Convert the following natural language request into a {db_type.upper()} query.
+
+Database Schema:
+{schema_info}
+
+Natural Language Request: {question}
+
+SQL Query:
+"""
+    return prompt
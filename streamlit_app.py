@@ -2,6 +2,7 @@ import streamlit as st
 import requests
 import json
 import pandas as pd
+import pyarrow as pa
 
 st.set_page_config(
     page_title="🧠 Gemini SQL Assistant", 
@@ -112,8 +113,10 @@ with col1:
         placeholder="e.g., Show me all users who registered in the last 30 days"
     )
     
-    # Generate SQL button
-    if st.button("🚀 Generate SQL", type="primary"):
+    # Generate SQL buttons; answers are cached per question, Regenerate asks Gemini again
+    generate_clicked = st.button("🚀 Generate SQL", type="primary")
+    regenerate_clicked = st.button("🔄 Regenerate", help="Ask Gemini for a fresh query instead of reusing the previous answer")
+    if generate_clicked or regenerate_clicked:
         if not question:
             st.warning("Please enter a question.")
         elif not st.session_state.schema_info:
@@ -124,7 +127,8 @@ with col1:
                     response = requests.post(f"{BACKEND_URL}/generate_query", json={
                         "question": question,
                         "schema": st.session_state.schema_info,
-                        "db_type": db_type
+                        "db_type": db_type,
+                        "force_refresh": regenerate_clicked
                     })
                     
                     if response.status_code == 200:
@@ -173,13 +177,20 @@ with col2:
                     "dbParams": db_params,
                     "sql": st.session_state.generated_sql,
                     "schema": st.session_state.schema_info,
-                    "question": question
+                    "question": question,
+                    "format": "arrow"
                 }
                 
                 with st.spinner("Executing SQL with auto-correction..."):
                     try:
                         response = requests.post(f"{BACKEND_URL}/execute_query", json=payload)
-                        result = response.json()
+                        if response.headers.get("Content-Type", "").startswith("application/vnd.apache.arrow.stream"):
+                            # Row results arrive as an Arrow table, with the outcome in its metadata
+                            table = pa.ipc.open_stream(response.content).read_all()
+                            result = json.loads(table.schema.metadata[b"result"])
+                            result["results"] = table.to_pandas(use_threads=True, split_blocks=True, self_destruct=True)
+                        else:
+                            result = response.json()
                         
                         if result.get("success"):
                             st.success(f"✅ Query executed successfully! (Attempts: {result.get('attempts', 1)})")
@@ -192,29 +203,28 @@ with col2:
                             
                             # Display results
                             results = result.get("results", [])
-                            if results:
-                                if isinstance(results, list) and len(results) > 0:
-                                    if isinstance(results[0], dict):
-                                        # Convert to DataFrame for better display
-                                        df = pd.DataFrame(results)
-                                        st.dataframe(df, use_container_width=True)
-                                        
-                                        # Download button
-                                        csv = df.to_csv(index=False)
-                                        st.download_button(
-                                            label="📥 Download as CSV",
-                                            data=csv,
-                                            file_name="query_results.csv",
-                                            mime="text/csv"
-                                        )
-                                    else:
-                                        st.write("Results:")
-                                        st.json(results)
-                                elif isinstance(results, dict):
-                                    st.write("Query Result:")
-                                    st.json(results)
-                                else:
-                                    st.write("No results returned.")
+                            if isinstance(results, list) and results and isinstance(results[0], dict):
+                                # Convert to DataFrame for better display
+                                results = pd.DataFrame(results)
+
+                            if isinstance(results, pd.DataFrame) and not results.empty:
+                                df = results
+                                st.dataframe(df, use_container_width=True)
+                                
+                                # Download button
+                                csv = df.to_csv(index=False)
+                                st.download_button(
+                                    label="📥 Download as CSV",
+                                    data=csv,
+                                    file_name="query_results.csv",
+                                    mime="text/csv"
+                                )
+                            elif isinstance(results, dict):
+                                st.write("Query Result:")
+                                st.json(results)
+                            elif isinstance(results, list) and results:
+                                st.write("Results:")
+                                st.json(results)
                             else:
                                 st.info("Query executed successfully but returned no results.")
                                 